@@ -1,12 +1,12 @@
 import logging
 import sys
-import smtplib
 from datetime import date, datetime, timedelta
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
 from src.core.config_loader import ConfigLoader
 from src.core.database import DatabaseManager
+from src.utils.helpers import open_smtp
 
 # Configuración de logging
 logging.basicConfig(
@@ -49,10 +49,15 @@ class AuditorReportService:
             res_cad = db.execute_single_query(sql_cadencia, fetchone=True)
             reporte['interval'] = str(res_cad[0]) if res_cad and res_cad[0] else "N/A"
 
-            # 2. Conteo Diario (Tablas de trabajo)
-            reporte['error_count'] = db.execute_single_query("SELECT COUNT(DISTINCT raw_data_id) FROM public.validation_error_by_rules WHERE DATE(created_at) = %s AND error_type = 'error'", (today_date,), fetchone=True)[0] or 0
-            reporte['alarm_count'] = db.execute_single_query("SELECT COUNT(DISTINCT raw_data_id) FROM public.validation_error_by_rules WHERE DATE(created_at) = %s AND error_type = 'alarm'", (today_date,), fetchone=True)[0] or 0
-            reporte['validados'] = db.execute_single_query("SELECT COUNT(*) FROM public.validated_data WHERE DATE(created_at) = %s", (today_date,), fetchone=True)[0] or 0
+            # 2. Conteo Diario (Tablas de trabajo), en un solo round-trip
+            sql_conteos = """
+                SELECT COUNT(DISTINCT raw_data_id) FILTER (WHERE error_type = 'error'),
+                       COUNT(DISTINCT raw_data_id) FILTER (WHERE error_type = 'alarm'),
+                       (SELECT COUNT(*) FROM public.validated_data WHERE created_at >= %s AND created_at < %s)
+                FROM public.validation_error_by_rules WHERE created_at >= %s AND created_at < %s;
+            """
+            conteos = db.execute_single_query(sql_conteos, (today_date, today_date + timedelta(days=1)) * 2, fetchone=True)
+            reporte['error_count'], reporte['alarm_count'], reporte['validados'] = (c or 0 for c in conteos)
 
             # 3. Exclusiones (Ventana de 7 días exactos cruzados con los datos reales)
             sql_excl = """
@@ -112,7 +117,8 @@ class AuditorReportService:
         return reporte
 
     def generar_html(self) -> str:
-        rows_html = ""
+        # Filas acumuladas en lista y unidas al final (sin concatenación cuadrática)
+        filas = []
         for r in self.reportes:
             # Lógica de Badge
             if not r['has_activity']:
@@ -129,7 +135,7 @@ class AuditorReportService:
             btn_graficas = f'<a href="{r["drive_link"]}" target="_blank" style="display:inline-block; padding:6px 12px; background:#1976d2; color:white; text-decoration:none; border-radius:15px; font-size:11px; font-weight:bold; box-shadow: 0 2px 5px rgba(0,0,0,0.1);">Ver Datos 📊</a>' if r['drive_link'] != '#' else '<span style="color:#adb5bd;font-size:18px;">&ndash;</span>'
             kpi_color = "#2e7d32" if r['kpi_gap'] <= 6 else ("#f9a825" if r['kpi_gap'] <= 10 else "#c62828")
             
-            rows_html += f"""
+            filas.append(f"""
             <tr style="border-bottom: 1px solid #eeeeee;">
                 <td style="padding:15px 10px; text-align:center;"><span style="background-color:{badge_bg}; color:{badge_fg}; padding:6px 14px; border-radius:20px; font-size:11px; font-weight:bold; white-space:nowrap; display:inline-block;">{icon} {status_text.upper()}</span></td>
                 <td style="padding:15px 10px; font-weight:600; color:#424242;">{r['plant_name']}</td>
@@ -144,7 +150,8 @@ class AuditorReportService:
                 <td style="padding:15px 10px; text-align:right;"><div style="font-size:12px; color:#424242; line-height:1.4;"><span style="font-weight:700;">{r['excl_min']}</span> min<br><span style="font-weight:700;">{r['excl_hor']}</span> h<br><span style="font-size:11px; color:#757575;">{r['excl_dia']} d</span></div></td>
                 <td style="padding:15px 10px; text-align:center;">{btn_graficas}</td>
             </tr>
-            """
+            """)
+        rows_html = "".join(filas)
         
         return f"""
         <!DOCTYPE html><html><head><meta charset="utf-8">
@@ -184,9 +191,7 @@ class AuditorReportService:
             msg['Subject'] = f"Reporte Semanal de Control de Carga de Datos - COLOMBIA {date.today().strftime('%d/%m')}"
             msg.attach(MIMEText(html_body, 'html', 'utf-8'))
             
-            with smtplib.SMTP(self.config.smtp_config['server'], self.config.smtp_config['port']) as server:
-                server.starttls()
-                server.login(self.config.smtp_config['user'], self.config.smtp_config['password'])
+            with open_smtp(self.config.smtp_config) as server:
                 server.send_message(msg)
                 
             logging.info(f"Reporte global enviado a {len(self.config.auditor_emails)} auditores.")
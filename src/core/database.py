@@ -1,9 +1,28 @@
+import io
+import math
+import itertools
 import psycopg2
+import psycopg2.errors
+from psycopg2 import sql
 import logging
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT, ISOLATION_LEVEL_DEFAULT
+import numpy as np
+import pandas as pd
+from psycopg2.extensions import register_adapter, register_type, new_type, AsIs, Float
 from typing import List
 from src.models.plant import Plant
 
+def _adapt_float(value):
+    """NaN viaja como NULL (no como 'NaN'::float, que NUMERIC aceptaría como dato)."""
+    return AsIs('NULL') if math.isnan(value) else Float(value)
+
+# Adaptadores a nivel driver: los DataFrames se envían sin convertir NaN -> None en Python
+register_adapter(float, _adapt_float)
+register_adapter(np.float64, _adapt_float)
+register_adapter(np.int64, AsIs)
+
+# NUMERIC -> float para cursores de lectura puntuales (se registra por cursor, no global): evita un Decimal por celda
+NUMERIC_A_FLOAT = new_type((1700,), "NUMERIC_A_FLOAT", lambda valor, cur: float(valor) if valor is not None else None)
+
 class DatabaseManager:
     def __init__(self, plant: Plant, connect_to_postgres_db: bool = False):
         self.plant = plant
@@ -13,7 +32,12 @@ class DatabaseManager:
         
         self.conn = None
         self.cursor = None
+        self._prepared = set()
+        self._columns_cache = {}
         self._connect(db_to_connect)
+        if connect_to_postgres_db:
+            # Conexión de administración: CREATE DATABASE no puede correr dentro de una transacción
+            self.conn.autocommit = True
 
     def _connect(self, db_to_connect: str):
         try:
@@ -30,11 +54,12 @@ class DatabaseManager:
             raise e
 
     def execute_queries(self, queries: List[str]):
-        """Ejecuta una lista de queries con autocommit seguro"""
+        """Ejecuta una lista de queries en un solo round-trip (script multi-sentencia) con autocommit seguro"""
+        script = "\n".join(q.strip().rstrip(';') + ';' for q in queries if q and q.strip())
+        if not script:
+            return
         try:
-            for query in queries:
-                if query and query.strip():
-                    self.cursor.execute(query)
+            self.cursor.execute(script)
             self.conn.commit()
         except Exception as e:
             self.conn.rollback()
@@ -54,16 +79,81 @@ class DatabaseManager:
             self.conn.rollback()
             raise e
 
+    def get_table_columns(self, table_name: str) -> List[str]:
+        """Columnas de una tabla en orden físico; se consulta information_schema una sola vez por conexión."""
+        key = table_name.lower()
+        if key not in self._columns_cache:
+            query = "SELECT column_name FROM information_schema.columns WHERE lower(table_name) = %s ORDER BY ordinal_position;"
+            self._columns_cache[key] = [row[0] for row in self.execute_single_query(query, (key,), fetchall=True)]
+        return list(self._columns_cache[key])
+
+    def query_dataframe(self, query: str, params: tuple = None, itersize: int = 20000) -> pd.DataFrame:
+        """SELECT -> DataFrame leyendo por lotes con un cursor del lado del servidor (sin fetchall intermedio)."""
+        with self.conn.cursor(name='dataframe_stream') as cur:
+            cur.itersize = itersize
+            # pd.read_sql terminaba convirtiendo los Decimal a float (coerce_float): se hace directo en el driver
+            register_type(NUMERIC_A_FLOAT, cur)
+            cur.execute(query, params)
+            primeras = cur.fetchmany(itersize)
+            columnas = [d[0] for d in cur.description]
+            df = pd.DataFrame.from_records(itertools.chain(primeras, cur), columns=columnas, coerce_float=True)
+        # Igual que pd.read_sql: las columnas con zona horaria se normalizan a UTC
+        for col in df.select_dtypes(include=['datetimetz']).columns:
+            df[col] = df[col].dt.tz_convert('UTC')
+        return df
+
+    def copy_dataframe(self, query: str, parse_dates: List[str] = None) -> pd.DataFrame:
+        """SELECT -> DataFrame vía COPY TO STDOUT (CSV): sin objetos Python por celda en el driver, parseo con el lector C de pandas."""
+        buffer = io.StringIO()
+        # Fechas en texto ISO sin depender del DateStyle del servidor (LOCAL: se revierte al cerrar la transacción)
+        self.cursor.execute("SET LOCAL DateStyle TO ISO;")
+        self.cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT CSV, HEADER TRUE)", buffer)
+        buffer.seek(0)
+        # round_trip: mismo float que float(texto), como en query_dataframe
+        df = pd.read_csv(buffer, float_precision='round_trip')
+        for col in parse_dates or []:
+            # ISO8601 explícito: el formato inferido del primer valor falla si se mezclan segundos enteros y fraccionarios
+            df[col] = pd.to_datetime(df[col], utc=True, format='ISO8601')
+        return df
+
+    def prepare(self, name: str, statement: str, param_types: tuple = ()):
+        """PREPARE idempotente: los statements viven toda la sesión (sobreviven a commit/rollback)."""
+        if name in self._prepared:
+            return
+        signature = f"({', '.join(param_types)})" if param_types else ""
+        self.cursor.execute(f"PREPARE {name}{signature} AS {statement}")
+        self._prepared.add(name)
+
+    @staticmethod
+    def _copy_value(value) -> str:
+        """Serializa un valor al formato texto de COPY (None/NaN/NaT como \\N y escapes de control)."""
+        # pd.NA no admite comparación booleana (value != value lanza TypeError): se detecta por identidad
+        if value is None or value is pd.NA or value is pd.NaT or (isinstance(value, float) and value != value):
+            return '\\N'
+        text = str(value)
+        return text.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+    def copy_records(self, table: str, columns: List[str], records) -> int:
+        """Carga masiva vía COPY FROM STDIN. No hace commit: la transacción la controla el llamador."""
+        buffer = io.StringIO()
+        count = 0
+        for record in records:
+            buffer.write('\t'.join(self._copy_value(v) for v in record))
+            buffer.write('\n')
+            count += 1
+        if not count:
+            return 0
+        buffer.seek(0)
+        cols_str = ", ".join(f'"{c}"' for c in columns)
+        self.cursor.copy_expert(f'COPY {table} ({cols_str}) FROM STDIN', buffer)
+        return count
+
     def create_database(self):
         """Solo usado en el setup inicial para crear la base de datos vacía."""
-        self.cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s;", (self.db_name,))
-        if self.cursor.fetchone():
-            return # Ya existe
         try:
-            self.conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-            self.cursor.execute(f'CREATE DATABASE "{self.db_name}";')
-        finally:
-            self.conn.set_isolation_level(ISOLATION_LEVEL_DEFAULT)
+            self.cursor.execute(sql.SQL("CREATE DATABASE {};").format(sql.Identifier(self.db_name)))
+        except psycopg2.errors.DuplicateDatabase:
+            pass # Ya existe
 
     def close(self):
         if self.cursor: self.cursor.close()
@@ -1,5 +1,5 @@
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 from src.core.database import DatabaseManager
 from src.models.plant import Plant
 from src.core.config_loader import ConfigLoader
@@ -12,6 +12,7 @@ from src.services.exporter import DataExporter
 from src.services.graphics import GraphicsGenerator
 from src.services.notifier import Notifier
 from src.services.state_manager import StateManager
+from src.services.schema_builder import SchemaBuilder
 
 class AletheiaPipeline:
     def __init__(self, config: ConfigLoader):
@@ -25,6 +26,8 @@ class AletheiaPipeline:
         db_manager = None
         try:
             db_manager = DatabaseManager(plant)
+            # BDs creadas con versiones anteriores del esquema
+            SchemaBuilder.upgrade(db_manager)
             state_mgr = StateManager(db_manager)
             
             # 1. Recuperar contexto previo (Incluyendo métricas para heredar)
@@ -76,8 +79,12 @@ class AletheiaPipeline:
             if final_status == "ACTIVA":
                 # Recolectar KPIs reales generados en esta corrida
                 today = datetime.now().date()
-                err_count = db_manager.execute_single_query("SELECT COUNT(*) FROM validation_error_by_rules WHERE DATE(created_at) = %s AND error_type = 'error'", (today,), fetchone=True)[0] or 0
-                alr_count = db_manager.execute_single_query("SELECT COUNT(*) FROM validation_error_by_rules WHERE DATE(created_at) = %s AND error_type = 'alarm'", (today,), fetchone=True)[0] or 0
+                # Errores y alarmas del día en una sola pasada (un round-trip)
+                sql_conteos = """
+                    SELECT COUNT(*) FILTER (WHERE error_type = 'error'), COUNT(*) FILTER (WHERE error_type = 'alarm')
+                    FROM validation_error_by_rules WHERE created_at >= %s AND created_at < %s
+                """
+                err_count, alr_count = db_manager.execute_single_query(sql_conteos, (today, today + timedelta(days=1)), fetchone=True)
                 
                 sql_cadencia = """
                     WITH CalculoPrevio AS (SELECT "timestamp" FROM public.raw_data WHERE "timestamp" IS NOT NULL ORDER BY "timestamp" DESC LIMIT 5000),
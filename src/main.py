@@ -1,5 +1,7 @@
+import os
 import sys
 import logging
+import multiprocessing as mp
 from src.core.config_loader import ConfigLoader
 from src.core.pipeline import AletheiaPipeline
 
@@ -11,16 +13,39 @@ logging.basicConfig(
     handlers=[logging.StreamHandler(sys.stdout)]
 )
 
+def _run_plant(args):
+    """Ejecuta el pipeline completo de una planta dentro de un proceso worker."""
+    config, plant = args
+    AletheiaPipeline(config).run(plant)
+
+def _pipeline_workers(n_plants: int) -> int:
+    """Lee PIPELINE_WORKERS: valores vacíos o inválidos caen a 1 (secuencial) y nunca supera el número de plantas."""
+    raw = os.getenv("PIPELINE_WORKERS", "1").strip()
+    try:
+        workers = int(raw or "1")
+    except ValueError:
+        logging.warning(f"PIPELINE_WORKERS='{raw}' no es un entero. Se usa 1 (secuencial).")
+        workers = 1
+    return max(1, min(workers, n_plants))
+
 def main():
     config = ConfigLoader("config.json")
     if not config.plants:
         logging.error("No se encontraron plantas configuradas. Saliendo.")
         sys.exit(1)
 
-    pipeline = AletheiaPipeline(config)
+    # Cada planta tiene su propia BD: se pueden procesar en paralelo (un proceso y una conexión por planta)
+    workers = _pipeline_workers(len(config.plants))
+    if workers == 1:
+        logging.info(f"Procesando {len(config.plants)} plantas de forma secuencial (1 proceso).")
+        pipeline = AletheiaPipeline(config)
+        for plant in config.plants:
+            pipeline.run(plant)
+        return
 
-    for plant in config.plants:
-        pipeline.run(plant)
+    logging.info(f"Procesando {len(config.plants)} plantas con {workers} procesos en paralelo.")
+    with mp.Pool(workers) as pool:
+        pool.map(_run_plant, [(config, plant) for plant in config.plants], chunksize=1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,8 +1,13 @@
 import logging
+import re
+from datetime import timedelta
 from src.core.database import DatabaseManager
 from src.models.plant import Plant
 
 class DuplicateHandler:
+    # Ventana de cada lote; como se particiona por timestamp, ningún grupo de duplicados cruza lotes
+    CHUNK_DAYS = 30
+
     def __init__(self, db_manager: DatabaseManager, plant: Plant):
         self.db = db_manager
         self.plant = plant
@@ -13,12 +18,8 @@ class DuplicateHandler:
         
         try:
             # 1. Introspección de columnas (col_X)
-            query_cols = """
-                SELECT column_name FROM information_schema.columns 
-                WHERE lower(table_name) = 'raw_data' AND column_name LIKE 'col_%' 
-                ORDER BY ordinal_position;
-            """
-            cols_datos = [fila[0] for fila in self.db.execute_single_query(query_cols, fetchall=True)]
+            # Mismo criterio que el LIKE 'col_%' original: en LIKE el '_' es comodín de un carácter
+            cols_datos = [c for c in self.db.get_table_columns('raw_data') if re.match(r'^col.', c, re.DOTALL)]
             
             if not cols_datos:
                 logging.warning(f"[{self.plant.name}] No se encontraron columnas de datos (col_X) en raw_data.")
@@ -31,37 +32,47 @@ class DuplicateHandler:
             columnas_destino = ['raw_data_id', 'timestamp_col'] + cols_datos
             columnas_destino_str = ", ".join([f'"{c}"' for c in columnas_destino])
 
-            # 3. Queries CTE (Common Table Expression)
-            consulta_cte = """
-            WITH filas_clasificadas AS (
-                SELECT *, ROW_NUMBER() OVER (PARTITION BY timestamp ORDER BY id ASC) as rn 
-                FROM raw_data
+            # 3. Query única por lote: el DELETE ... RETURNING alimenta el INSERT
+            # Duplicado = existe otra fila con el mismo timestamp y menor id (sondeos al índice (timestamp, id), sin ordenar todo)
+            columnas_retorno_str = ", ".join([f'r."{c}"' for c in columnas_origen])
+            consulta_mover = f"""
+            WITH filas_duplicadas AS (
+                SELECT r.id
+                FROM raw_data r
+                WHERE r.timestamp >= %s AND r.timestamp < %s
+                  AND EXISTS (
+                      SELECT 1 FROM raw_data r2
+                      WHERE r2.timestamp = r.timestamp AND r2.id < r.id
+                  )
+            ),
+            filas_borradas AS (
+                DELETE FROM raw_data r
+                USING filas_duplicadas f
+                WHERE r.id = f.id
+                RETURNING {columnas_retorno_str}
             )
-            """
-            
-            consulta_mover = consulta_cte + f"""
             INSERT INTO duplicated_data ({columnas_destino_str})
-            SELECT {columnas_origen_str} FROM filas_clasificadas WHERE rn > 1;
-            """
-            
-            consulta_eliminar = consulta_cte + """
-            DELETE FROM raw_data WHERE id IN (SELECT id FROM filas_clasificadas WHERE rn > 1);
+            SELECT {columnas_origen_str} FROM filas_borradas;
             """
 
-            # 4. Ejecución Transaccional
-            self.db.cursor.execute(consulta_mover)
-            filas_movidas = self.db.cursor.rowcount
-            logging.info(f"[{self.plant.name}] Se movieron {filas_movidas} registros duplicados.")
+            # 4. Ejecución por lotes de tiempo (commit por lote para acotar memoria y locks)
+            rango = self.db.execute_single_query("SELECT MIN(timestamp), MAX(timestamp) FROM raw_data;", fetchone=True)
+            if not rango or rango[0] is None:
+                logging.info(f"[{self.plant.name}] 'raw_data' está vacía. Nada que depurar.")
+                return
 
-            if filas_movidas > 0:
-                self.db.cursor.execute(consulta_eliminar)
-                filas_eliminadas = self.db.cursor.rowcount
-                logging.info(f"[{self.plant.name}] Se eliminaron {filas_eliminadas} registros duplicados de 'raw_data'.")
-                
-                if filas_movidas != filas_eliminadas:
-                    raise Exception("Discrepancia en conteo de filas movidas vs. eliminadas.")
+            filas_movidas = 0
+            inicio, fin = rango
+            while inicio <= fin:
+                limite = inicio + timedelta(days=self.CHUNK_DAYS)
+                # El chequeo FK de duplicated_data se difiere al commit del lote (FK DEFERRABLE vía SchemaBuilder.upgrade)
+                self.db.cursor.execute("SET CONSTRAINTS ALL DEFERRED;")
+                self.db.cursor.execute(consulta_mover, (inicio, limite))
+                filas_movidas += self.db.cursor.rowcount
+                self.db.conn.commit()
+                inicio = limite
 
-            self.db.conn.commit()
+            logging.info(f"[{self.plant.name}] Se movieron {filas_movidas} registros duplicados desde 'raw_data'.")
             
         except Exception as e:
             self.db.conn.rollback()
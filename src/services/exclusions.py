@@ -1,8 +1,8 @@
+import os
+import pickle
 import logging
-from datetime import datetime
 from pathlib import Path
 import pandas as pd
-from psycopg2.extras import execute_values
 import gspread
 from google.oauth2.service_account import Credentials
 
@@ -11,10 +11,60 @@ from src.core.database import DatabaseManager
 from src.utils.helpers import ColumnNameProcessor
 
 class ExclusionManager:
+    EXCLUSION_COLUMNS = [
+        'form_timestamp', 'exclusion_start', 'exclusion_end', 'exclusion_type',
+        'exclusion', 'motivo', 'observacion', 'potencia_pico_kw', 'excluded_variables'
+    ]
+    # Registros de validated_data borrados por lote en el cleaner retroactivo
+    CLEANER_BATCH_SIZE = 10000
+
     def __init__(self, db_manager: DatabaseManager, plant: Plant, creds_path: Path):
         self.db = db_manager
         self.plant = plant
         self.creds_path = creds_path
+        # Caché opcional de la hoja (EXCLUSIONS_CACHE=1), útil en corridas repetidas y reintentos
+        self.use_cache = os.getenv("EXCLUSIONS_CACHE", "0") == "1"
+        # Estado de ejecución: va junto a los datos de la planta (data/<id>/), no en la config versionada
+        self.cache_file = Path(self.plant.input_path).parent / 'exclusions_cache.pkl'
+
+    @staticmethod
+    def _fetch_values(worksheet) -> pd.DataFrame:
+        """Trae la hoja en una sola llamada de valores y arma el DataFrame con la primera fila como encabezado."""
+        values = worksheet.get_values()
+        if not values:
+            return pd.DataFrame()
+        return pd.DataFrame(values[1:], columns=values[0])
+
+    def _read_worksheet(self, client, gs_sheet: str) -> pd.DataFrame:
+        """Descarga la hoja de exclusiones, reutilizando la caché local si la hoja no cambió en Drive."""
+        spreadsheet = client.open(gs_sheet)
+        worksheet = spreadsheet.sheet1
+        if not self.use_cache:
+            return self._fetch_values(worksheet)
+
+        try:
+            # modifiedTime de Drive como validador de la caché
+            clave = (spreadsheet.id, worksheet.id, spreadsheet.get_lastUpdateTime())
+        except Exception as e:
+            # Sin fecha de modificación no se sabe si la caché está al día: servirla podría ignorar exclusiones nuevas
+            logging.warning(f"[{self.plant.name}] No se pudo consultar la modificación de la hoja en Drive ({e}). Se descarga la hoja sin caché.")
+            return self._fetch_values(worksheet)
+
+        if self.cache_file.exists():
+            try:
+                with open(self.cache_file, 'rb') as f:
+                    clave_cache, df_cache = pickle.load(f)
+                if clave == clave_cache:
+                    logging.info(f"[{self.plant.name}] Hoja de exclusiones sin cambios, usando caché local.")
+                    return df_cache
+            except (OSError, pickle.UnpicklingError, EOFError) as e:
+                logging.warning(f"[{self.plant.name}] Caché de exclusiones ilegible ({e}). Se descarga la hoja.")
+
+        df = self._fetch_values(worksheet)
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.cache_file, 'wb') as f:
+            pickle.dump((clave, df), f)
+        return df
 
     def sync_from_sheets(self):
         """Descarga e inserta/actualiza exclusiones desde Google Sheets (Script 2)."""
@@ -31,9 +81,7 @@ class ExclusionManager:
             creds = Credentials.from_service_account_file(str(self.creds_path), scopes=scope)
             client = gspread.authorize(creds)
             
-            worksheet = client.open(gs_sheet).sheet1
-            data = worksheet.get_all_records()
-            df = pd.DataFrame(data)
+            df = self._read_worksheet(client, gs_sheet)
             
             if df.empty:
                 logging.info(f"[{self.plant.name}] La hoja de exclusiones está vacía.")
@@ -44,6 +92,8 @@ class ExclusionManager:
             df['exclusion_end'] = pd.to_datetime(pd.to_datetime(df['Seleccione la fecha exacta de finalización de la exclusión:'], dayfirst=True, errors='coerce').dt.strftime('%Y-%m-%d') + ' ' + df['Seleccione la hora exacta de finalización de la exclusión:'].astype(str).str.strip(), errors='coerce')
             df['form_timestamp'] = pd.to_datetime(df['Marca temporal'], dayfirst=True, errors='coerce')
             df.dropna(subset=['form_timestamp', 'exclusion_start', 'exclusion_end'], inplace=True)
+            # La unicidad se resuelve aquí (gana la última respuesta) para que el UPSERT no choque consigo mismo
+            df.drop_duplicates(subset=['form_timestamp'], keep='last', inplace=True)
 
             # Transformación de Variables
             def parse_vars(val):
@@ -62,30 +112,36 @@ class ExclusionManager:
             col_motivo = next((c for c in df.columns if 'motivo' in c.lower()), None)
             col_obs = next((c for c in df.columns if 'observaci' in c.lower()), None)
 
-            records = []
-            for _, row in df.iterrows():
-                records.append((
-                    row['form_timestamp'], row['exclusion_start'], row['exclusion_end'],
-                    row[col_tipo] if col_tipo else None, row['exclusion'], 
-                    row[col_motivo] if col_motivo else None, row[col_obs] if col_obs else None,
-                    row['potencia_pico_kw'], row['excluded_variables_parsed']
-                ))
-
-            # UPSERT Query
-            query = """
-                INSERT INTO excluded_data (
-                    form_timestamp, exclusion_start, exclusion_end, exclusion_type,
-                    exclusion, motivo, observacion, potencia_pico_kw, excluded_variables
-                ) VALUES %s
+            # Construcción columnar del lote (sin iterrows); NaN/NaT se serializan como NULL en el COPY
+            df_final = pd.DataFrame({
+                'form_timestamp': df['form_timestamp'], 'exclusion_start': df['exclusion_start'],
+                'exclusion_end': df['exclusion_end'], 'exclusion_type': df[col_tipo] if col_tipo else None,
+                'exclusion': df['exclusion'], 'motivo': df[col_motivo] if col_motivo else None,
+                'observacion': df[col_obs] if col_obs else None, 'potencia_pico_kw': df['potencia_pico_kw'],
+                'excluded_variables': df['excluded_variables_parsed']
+            }, columns=self.EXCLUSION_COLUMNS)
+
+            # UPSERT vía staging: COPY a una tabla temporal y un único INSERT ... SELECT
+            cols_str = ", ".join(self.EXCLUSION_COLUMNS)
+            self.db.cursor.execute(f"""
+                CREATE TEMP TABLE staging_excluded_data ON COMMIT DROP AS
+                SELECT {cols_str} FROM excluded_data WITH NO DATA;
+            """)
+            # Las filas se generan directo desde el DataFrame hacia el buffer del COPY (sin lista intermedia)
+            n_registros = self.db.copy_records("staging_excluded_data", self.EXCLUSION_COLUMNS, df_final.itertuples(index=False, name=None))
+
+            query = f"""
+                INSERT INTO excluded_data ({cols_str})
+                SELECT {cols_str} FROM staging_excluded_data
                 ON CONFLICT (form_timestamp) DO UPDATE SET
                     exclusion_start=EXCLUDED.exclusion_start, exclusion_end=EXCLUDED.exclusion_end,
                     exclusion_type=EXCLUDED.exclusion_type, exclusion=EXCLUDED.exclusion,
                     motivo=EXCLUDED.motivo, observacion=EXCLUDED.observacion,
                     potencia_pico_kw=EXCLUDED.potencia_pico_kw, excluded_variables=EXCLUDED.excluded_variables;
             """
-            execute_values(self.db.cursor, query, records)
+            self.db.cursor.execute(query)
             self.db.conn.commit()
-            logging.info(f"[{self.plant.name}] ✓ {len(records)} exclusiones procesadas (UPSERT).")
+            logging.info(f"[{self.plant.name}] ✓ {n_registros} exclusiones procesadas (UPSERT).")
             
         except Exception as e:
             self.db.conn.rollback()
@@ -95,47 +151,68 @@ class ExclusionManager:
         """Aplica las reglas de exclusión a la data ya validada y genera logs (Script 7)."""
         logging.info(f"[{self.plant.name}] Aplicando Exclusiones Retroactivas (Cleaner)...")
         
-        analysis_query = """
-        SELECT 
-            v.id AS target_id, v.timestamp, e_del.id AS rule_id,
-            CASE 
-                WHEN EXISTS (
-                    SELECT 1 FROM excluded_data e_acc
-                    WHERE v.timestamp >= e_acc.exclusion_start 
-                      AND v.timestamp <= e_acc.exclusion_end
-                      AND TRIM(e_acc.exclusion_type) ILIKE '%Aceptaci%n%'
-                ) THEN 'PROTECTED'
-                ELSE 'TO_DELETE'
-            END AS action_status
+        # Filtros compartidos (los '%' van escapados porque las queries llevan parámetros)
+        cond_borrado = """
+            e_del.exclusion = 0 AND TRIM(e_del.exclusion_type) ILIKE 'Exclusi%%n de periodo marcado'
+        """
+        cond_protegido = """
+            EXISTS (
+                SELECT 1 FROM excluded_data e_acc
+                WHERE v.timestamp >= e_acc.exclusion_start 
+                  AND v.timestamp <= e_acc.exclusion_end
+                  AND TRIM(e_acc.exclusion_type) ILIKE '%%Aceptaci%%n%%'
+            )
+        """
+        count_protected_query = f"""
+        SELECT COUNT(*)
         FROM validated_data v
         JOIN excluded_data e_del 
           ON v.timestamp >= e_del.exclusion_start 
           AND v.timestamp <= e_del.exclusion_end
-        WHERE e_del.exclusion = 0 AND TRIM(e_del.exclusion_type) ILIKE 'Exclusi%n de periodo marcado';
+        WHERE {cond_borrado} AND {cond_protegido};
+        """
+        # Lote: elige ids a borrar, borra y registra un log por (regla, registro) a partir de lo borrado, todo en un statement
+        delete_batch_query = f"""
+        WITH objetivos AS (
+            SELECT DISTINCT v.id
+            FROM validated_data v
+            JOIN excluded_data e_del 
+              ON v.timestamp >= e_del.exclusion_start 
+              AND v.timestamp <= e_del.exclusion_end
+            WHERE {cond_borrado} AND NOT {cond_protegido}
+            LIMIT %s
+        ),
+        borrados AS (
+            DELETE FROM validated_data v USING objetivos o WHERE v.id = o.id
+            RETURNING v.id, v.timestamp
+        ),
+        logs AS (
+            INSERT INTO excluded_data_logs (excluded_data_id, deleted_id, operation_type, changed_by, created_at)
+            SELECT e_del.id, b.id, 'DELETE_RANGE', 'exclusions.py', NOW()
+            FROM borrados b
+            JOIN excluded_data e_del 
+              ON b.timestamp >= e_del.exclusion_start 
+              AND b.timestamp <= e_del.exclusion_end
+            WHERE {cond_borrado}
+        )
+        SELECT COUNT(*) FROM borrados;
         """
         
         try:
-            rows = self.db.execute_single_query(analysis_query, fetchall=True)
-            to_delete_ids = []
-            to_delete_logs = []
-            protected_count = 0
-
-            for row in rows:
-                if row[3] == 'PROTECTED':
-                    protected_count += 1
-                elif row[3] == 'TO_DELETE':
-                    to_delete_ids.append(row[0])
-                    to_delete_logs.append((row[2], row[0], 'DELETE_RANGE', 'exclusions.py', datetime.now()))
-
-            if to_delete_ids:
-                archive_query = "INSERT INTO excluded_data_logs (excluded_data_id, deleted_id, operation_type, changed_by, created_at) VALUES %s"
-                execute_values(self.db.cursor, archive_query, to_delete_logs)
-                
-                delete_query = "DELETE FROM validated_data WHERE id IN %s"
-                self.db.cursor.execute(delete_query, (tuple(to_delete_ids),))
-                
+            protected_count = self.db.execute_single_query(count_protected_query, (), fetchone=True)[0]
+            total_deleted = 0
+
+            # Borrado por lotes con commit por lote: locks cortos y WAL acotado
+            while True:
+                self.db.cursor.execute(delete_batch_query, (self.CLEANER_BATCH_SIZE,))
+                deleted = self.db.cursor.fetchone()[0]
                 self.db.conn.commit()
-                logging.info(f"[{self.plant.name}] ✓ {len(to_delete_ids)} registros eliminados por exclusión. (Protegidos: {protected_count})")
+                total_deleted += deleted
+                if deleted < self.CLEANER_BATCH_SIZE:
+                    break
+
+            if total_deleted:
+                logging.info(f"[{self.plant.name}] ✓ {total_deleted} registros eliminados por exclusión. (Protegidos: {protected_count})")
             else:
                 logging.info(f"[{self.plant.name}] No hay registros retroactivos para eliminar.")
                 
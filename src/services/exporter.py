@@ -4,14 +4,30 @@ from datetime import date, datetime, timedelta
 from decimal import Decimal
 from typing import Dict, Union, List
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
 from openpyxl.utils import get_column_letter
 
 # Módulos del proyecto
 from src.models.plant import Plant
 from src.core.database import DatabaseManager
+from src.utils.helpers import process_pool_executor
+
+# Decimal -> texto con coma decimal, como ufunc de objetos (una sola llamada por columna)
+_COMA_DECIMAL = str.maketrans('.', ',')
+_DECIMAL_A_COMA = np.frompyfunc(lambda x: str(x).translate(_COMA_DECIMAL) if isinstance(x, Decimal) else x, 1, 1)
+
+def _export_validated_report_process(plant: Plant):
+    """Genera el reporte de validados en un proceso worker, con su propia conexión."""
+    db = DatabaseManager(plant)
+    try:
+        DataExporter(db, plant).export_validated_report()
+    finally:
+        db.close()
 
 class DataExporter:
     def __init__(self, db_manager: DatabaseManager, plant: Plant):
@@ -28,8 +44,20 @@ class DataExporter:
     # =========================================================================
     # --- MOTOR DE EXPORTACIÓN ---
     # =========================================================================
+    @staticmethod
+    def _excel_date_format(serie: pd.Series):
+        """Formato de fecha por columna (el mismo que aplicaba pandas.to_excel), o None si no es fecha."""
+        if pd.api.types.is_datetime64_any_dtype(serie):
+            return 'YYYY-MM-DD HH:MM:SS'
+        primero = serie.first_valid_index()
+        if primero is None: return None
+        valor = serie.at[primero]
+        if isinstance(valor, datetime): return 'YYYY-MM-DD HH:MM:SS'
+        if isinstance(valor, date): return 'YYYY-MM-DD'
+        return None
+
     def _export_excel(self, data: Union[pd.DataFrame, Dict[str, pd.DataFrame]], filename: str, is_error_report=False):
-        """Genera archivos Excel con formato avanzado y soporte multi-hoja."""
+        """Genera archivos Excel con formato avanzado y soporte multi-hoja (los DataFrames se consumen: se modifican en el lugar)."""
         dict_dfs = data if isinstance(data, dict) else {'Datos': data}
         dict_dfs = {k: v for k, v in dict_dfs.items() if v is not None and not v.empty}
         
@@ -39,56 +67,67 @@ class DataExporter:
         
         full_path = os.path.join(self.out_dir, filename)
         
+        # Estilos visuales
+        header_fill = PatternFill(start_color="1F4E78", end_color="1F4E78", fill_type="solid")
+        header_font = Font(bold=True, color="FFFFFF")
+        center_align = Alignment(horizontal='center', vertical='center', wrap_text=True)
+        thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+        tipo_fills = {
+            'Error': (PatternFill(start_color="FFC7CE", fill_type="solid"), Font(color="9C0006", bold=True)),
+            'Alarma': (PatternFill(start_color="FFEB9C", fill_type="solid"), Font(color="9C6500", bold=True)),
+        }
+
         try:
-            with pd.ExcelWriter(full_path, engine='openpyxl') as writer:
-                for sheet_name, df_sheet in dict_dfs.items():
-                    df_copy = df_sheet.copy()
-                    
-                    # Limpieza de Timezones para Excel
-                    for col in df_copy.select_dtypes(include=['datetimetz']).columns:
-                        df_copy[col] = df_copy[col].dt.tz_localize(None)
-                    
-                    # Formateo de decimales a estilo español (coma)
-                    for col in df_copy.columns:
-                        if any(isinstance(x, Decimal) for x in df_copy[col].dropna()):
-                            df_copy[col] = df_copy[col].apply(lambda x: str(x).replace('.', ',') if isinstance(x, Decimal) else x)
-
-                    sheet_safe = sheet_name[:31]
-                    df_copy.to_excel(writer, index=False, sheet_name=sheet_safe)
-                    worksheet = writer.sheets[sheet_safe]
-                    
-                    # Estilos visuales
-                    header_fill = PatternFill(start_color="1F4E78", end_color="1F4E78", fill_type="solid")
-                    header_font = Font(bold=True, color="FFFFFF")
-                    center_align = Alignment(horizontal='center', vertical='center', wrap_text=True)
-                    thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-                    
-                    # Encabezados y ajuste de columnas
-                    for col_idx, col_name in enumerate(df_copy.columns, start=1):
-                        cell = worksheet.cell(row=1, column=col_idx)
-                        cell.fill, cell.font, cell.alignment, cell.border = header_fill, header_font, center_align, thin_border
-                        max_len = max((df_copy[col_name].astype(str).map(len).max() if not df_copy.empty else 0), len(str(col_name)))
-                        worksheet.column_dimensions[get_column_letter(col_idx)].width = max(min(max_len + 2, 50), 12)
-
-                    # Cuerpo de la tabla
-                    for row_idx in range(2, len(df_copy) + 2):
-                        for col_idx in range(1, len(df_copy.columns) + 1):
-                            cell = worksheet.cell(row=row_idx, column=col_idx)
-                            cell.alignment, cell.border = center_align, thin_border
-
-                    worksheet.auto_filter.ref = worksheet.dimensions 
-                    worksheet.freeze_panes = 'A2'
-
-                    # Formato condicional para reporte de errores
-                    if is_error_report and 'tipo_de_error' in df_copy.columns:
-                        col_tipo_idx = df_copy.columns.get_loc('tipo_de_error') + 1
-                        for row_idx in range(2, len(df_copy) + 2):
-                            cell = worksheet.cell(row=row_idx, column=col_tipo_idx)
-                            if cell.value == 'Error':
-                                cell.fill, cell.font = PatternFill(start_color="FFC7CE", fill_type="solid"), Font(color="9C0006", bold=True)
-                            elif cell.value == 'Alarma':
-                                cell.fill, cell.font = PatternFill(start_color="FFEB9C", fill_type="solid"), Font(color="9C6500", bold=True)
+            # Libro en modo write_only: las filas se escriben en streaming, sin mantener objetos Cell en memoria
+            wb = Workbook(write_only=True)
+            for sheet_name, df_sheet in dict_dfs.items():
+                # Sin df.copy(): cada DataFrame se arma solo para este reporte y se descarta al terminar
+                
+                # Limpieza de Timezones para Excel
+                for col in df_sheet.select_dtypes(include=['datetimetz']).columns:
+                    df_sheet[col] = df_sheet[col].dt.tz_localize(None)
+                
+                # Formateo de decimales a estilo español (coma): solo columnas object cuya muestra sea Decimal
+                for col in df_sheet.select_dtypes(include=['object']).columns:
+                    primero = df_sheet[col].first_valid_index()
+                    if primero is not None and isinstance(df_sheet[col].at[primero], Decimal):
+                        df_sheet[col] = _DECIMAL_A_COMA(df_sheet[col].to_numpy())
+
+                worksheet = wb.create_sheet(title=sheet_name[:31])
+                
+                # Ajuste de columnas (debe definirse antes de escribir filas)
+                for col_idx, col_name in enumerate(df_sheet.columns, start=1):
+                    max_len = max((df_sheet[col_name].astype(str).map(len).max() if not df_sheet.empty else 0), len(str(col_name)))
+                    worksheet.column_dimensions[get_column_letter(col_idx)].width = max(min(max_len + 2, 50), 12)
+
+                worksheet.freeze_panes = 'A2'
+                worksheet.auto_filter.ref = f"A1:{get_column_letter(len(df_sheet.columns))}{len(df_sheet) + 1}"
+
+                # Encabezados
+                encabezados = []
+                for col_name in df_sheet.columns:
+                    cell = WriteOnlyCell(worksheet, value=str(col_name))
+                    cell.fill, cell.font, cell.alignment, cell.border = header_fill, header_font, center_align, thin_border
+                    encabezados.append(cell)
+                worksheet.append(encabezados)
 
+                # Cuerpo de la tabla (NaN/NaT -> celda vacía) con formato condicional para reporte de errores
+                col_tipo_idx = df_sheet.columns.get_loc('tipo_de_error') if is_error_report and 'tipo_de_error' in df_sheet.columns else None
+                formatos = [self._excel_date_format(df_sheet[col]) for col in df_sheet.columns]
+                valores = df_sheet.astype(object).where(df_sheet.notna(), None)
+                for fila in valores.itertuples(index=False, name=None):
+                    celdas = []
+                    for col_idx, valor in enumerate(fila):
+                        cell = WriteOnlyCell(worksheet, value=valor)
+                        cell.alignment, cell.border = center_align, thin_border
+                        if formatos[col_idx] and valor is not None:
+                            cell.number_format = formatos[col_idx]
+                        if col_idx == col_tipo_idx and valor in tipo_fills:
+                            cell.fill, cell.font = tipo_fills[valor]
+                        celdas.append(cell)
+                    worksheet.append(celdas)
+
+            wb.save(full_path)
             logging.info(f"Archivo generado: {filename}")
         except Exception as e:
             logging.error(f"Fallo al guardar {filename}: {e}")
@@ -101,33 +140,47 @@ class DataExporter:
         """Orquestador de todos los reportes Excel."""
         logging.info(f"[{self.plant.name}] Generando reportes Excel...")
         
-        # 1. Reporte de Datos Validados
-        query_val = "SELECT * FROM public.validated_data WHERE DATE(created_at) = CURRENT_DATE ORDER BY timestamp;"
-        df_val = pd.read_sql(query_val, self.db.conn)
+        # 1. Reporte de Datos Validados (el más pesado): en un proceso aparte con su propia conexión,
+        #    así su escritura openpyxl (CPU, atada al GIL) se solapa con el resto de reportes
+        with process_pool_executor(1) as pool:
+            futuro_val = pool.submit(_export_validated_report_process, self.plant)
+
+            # 2. Reporte de Errores
+            self.export_errors_report()
+
+            # 3. Reporte de Exclusiones (Múltiples hojas)
+            self.export_exclusions_report()
+
+            # 4. Reporte de Días Faltantes (Solo fechas)
+            self.export_missing_days_report()
+
+            futuro_val.result()
+
+    def export_validated_report(self):
+        """Exporta las filas validadas hoy."""
+        # Solo las columnas del reporte, extraídas con COPY (el reporte más grande del día)
+        columnas = [c for c in self.db.get_table_columns('validated_data') if c not in ('id', 'raw_data_id', 'status', 'created_at', 'processed_at')]
+        cols_str = ", ".join(f'"{c}"' for c in columnas)
+        query_val = f"SELECT {cols_str} FROM public.validated_data WHERE created_at >= CURRENT_DATE AND created_at < CURRENT_DATE + 1 ORDER BY timestamp"
+        df_val = self.db.copy_dataframe(query_val, parse_dates=['timestamp'])
         if not df_val.empty:
-            df_val.drop(columns=['id', 'raw_data_id', 'status', 'created_at', 'processed_at'], inplace=True, errors='ignore')
             self._export_excel(df_val, f"reporte_validados_{self.today_str}.xlsx")
 
-        # 2. Reporte de Errores
+    def export_errors_report(self):
+        """Exporta los errores y alarmas detectados hoy."""
         query_err = """
             SELECT d.timestamp, e.error_type as tipo_de_error, COALESCE(vr.error_message, 'Error') AS mensajes_de_error,
                    e.offending_column as columnas_con_error, e.offending_value as valores_con_error
             FROM public.validation_error_by_rules e
             JOIN public.raw_data d ON e.raw_data_id = d.id
             LEFT JOIN public.validation_rules vr ON e.validation_rule_id = vr.id
-            WHERE DATE(e.created_at) = CURRENT_DATE ORDER BY d.timestamp;
+            WHERE e.created_at >= CURRENT_DATE AND e.created_at < CURRENT_DATE + 1 ORDER BY d.timestamp;
         """
-        df_err = pd.read_sql(query_err, self.db.conn)
+        df_err = self.db.query_dataframe(query_err)
         if not df_err.empty:
             df_err['tipo_de_error'] = df_err['tipo_de_error'].replace({'error': 'Error', 'alarm': 'Alarma'})
             self._export_excel(df_err, f"reporte_errores_{self.today_str}.xlsx", is_error_report=True)
 
-        # 3. Reporte de Exclusiones (Múltiples hojas)
-        self.export_exclusions_report()
-
-        # 4. Reporte de Días Faltantes (Solo fechas)
-        self.export_missing_days_report()
-
     def export_exclusions_report(self):
         """Crea el reporte de exclusiones segmentado por tipo."""
         query_exc = """
@@ -136,7 +189,7 @@ class DataExporter:
                    motivo, observacion, potencia_pico_kw, excluded_variables as variables_excluidas
             FROM public.excluded_data ORDER BY form_timestamp DESC;
         """
-        df_exc = pd.read_sql(query_exc, self.db.conn)
+        df_exc = self.db.query_dataframe(query_exc)
         if df_exc.empty: return
 
         hojas = {}
@@ -160,7 +213,7 @@ class DataExporter:
         """Identifica fechas sin carga en load_control y exporta solo la columna de fecha."""
         logging.info(f"[{self.plant.name}] Buscando fechas faltantes...")
         query = "SELECT inventory_date FROM public.load_control ORDER BY inventory_date ASC;"
-        df_inv = pd.read_sql(query, self.db.conn)
+        df_inv = self.db.query_dataframe(query)
         
         if df_inv.empty: return
 
@@ -186,10 +239,10 @@ class DataExporter:
         query = """
             SELECT ve.offending_column AS nombre_columna, COUNT(*) AS cantidad, ve.error_type
             FROM validation_error_by_rules ve
-            WHERE DATE(ve.created_at) = CURRENT_DATE
+            WHERE ve.created_at >= CURRENT_DATE AND ve.created_at < CURRENT_DATE + 1
             GROUP BY ve.offending_column, ve.error_type
         """
-        df = pd.read_sql(query, self.db.conn)
+        df = self.db.query_dataframe(query)
         if df.empty: return
 
         plt.style.use('ggplot')
@@ -1,14 +1,61 @@
 import os
 import json
 import logging
-from glob import glob
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from itertools import islice
 from pathlib import Path
 import pandas as pd
 from psycopg2.extras import execute_values
 
 from src.models.plant import Plant
 from src.core.database import DatabaseManager
-from src.utils.helpers import ColumnNameProcessor, enforce_pg_numeric_constraints, SmartCsvReader
+from src.utils.helpers import ColumnNameProcessor, enforce_pg_numeric_constraints, SmartCsvReader, process_pool_executor
+
+def _read_and_clean_csv(file_path: str, target_columns: list, min_rows_expected: int):
+    """Lee y limpia un CSV sin tocar la BD (corre en procesos worker). Retorna (df, None) o (None, (tipo_error, descripcion))."""
+    db_num_columns = len(target_columns)
+    ts_col = target_columns[0]
+
+    # 1. Lectura
+    try:
+        df = SmartCsvReader.read_csv_robust(file_path, db_num_columns)
+    except ValueError as e:
+        return None, ("ERROR_LECTURA", str(e))
+
+    # 2. Validación de columnas
+    if len(df.columns) != db_num_columns:
+        return None, ("ERROR_COLUMNAS", f"Esperadas {db_num_columns}, encontradas {len(df.columns)}")
+        
+    df.columns = target_columns
+
+    # 3. Limpieza de Fechas
+    df[ts_col] = df[ts_col].astype(str).str.strip()
+    total_rows_pre = len(df)
+    df[ts_col] = pd.to_datetime(df[ts_col], infer_datetime_format=True, errors='coerce')
+    
+    if df[ts_col].isna().all() and total_rows_pre > 0:
+        return None, ("ERROR_PARSE_FECHAS", "Fallo total de parseo de fechas. Formato desconocido.")
+
+    df.dropna(subset=[ts_col], inplace=True)
+
+    # 4. Limpieza Numérica
+    # Solo las columnas que el parser dejó como texto pasan por replace/to_numeric;
+    # el redondeo y recorte se aplican de una vez sobre el bloque numérico completo
+    numeric_cols = [c for c in target_columns if c != ts_col]
+    for col in numeric_cols:
+        if not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col].astype(str).str.replace(',', '.', regex=False), errors='coerce')
+    df[numeric_cols] = enforce_pg_numeric_constraints(df[numeric_cols].astype(float))
+
+    df.dropna(how='all', subset=numeric_cols, inplace=True)
+    cleaned_rows = len(df)
+
+    if cleaned_rows < min_rows_expected:
+        return None, ("ERROR_FILAS", f"Filas insuficientes: {cleaned_rows} (Pre: {total_rows_pre})")
+
+    return df, None
 
 class DataExtractor:
     def __init__(self, db_manager: DatabaseManager, plant: Plant):
@@ -22,44 +69,51 @@ class DataExtractor:
         # Rutas específicas de esta planta
         self.input_dir = Path(self.plant.input_path)
         self.state_file = Path(self.plant.rules_path).parent / 'processed_files.json'
+        # Historial leído en _get_new_files, reutilizado en _save_state (una sola lectura por corrida)
+        self._registered_files = None
         
         # Configuraciones de negocio (Podrían venir del settings.json de la planta en el futuro)
         self.min_rows_expected = int(os.getenv("MIN_ROWS_EXPECTED", "0"))
+        # Carga rápida opcional: commits por archivo sin esperar el flush del WAL (recargas idempotentes)
+        self.fast_load = os.getenv("FAST_LOAD", "0") == "1"
 
     def _get_new_files(self) -> set:
         if not self.input_dir.exists(): return set()
             
-        current_filenames = {f.name.strip() for f in self.input_dir.glob("*.csv")}
+        # os.scandir reutiliza la información de cada entrada del directorio (sin stat extra por archivo)
+        with os.scandir(self.input_dir) as entradas:
+            current_filenames = {e.name.strip() for e in entradas if fnmatch(e.name, "*.csv") and e.is_file()}
         
-        registered_filenames = set()
-        if self.state_file.exists():
-            try:
-                with open(self.state_file, 'r', encoding='utf-8') as f:
-                    # NORMALIZACIÓN: Extraer solo el nombre del archivo de lo que sea que haya en el JSON
-                    registered_filenames = {os.path.basename(f_path).strip() for f_path in json.load(f)}
-            except: pass
-                
+        # NORMALIZACIÓN: Extraer solo el nombre del archivo de lo que sea que haya en el JSON
+        registered_filenames = {os.path.basename(f_path).strip() for f_path in self._load_state()}
         return current_filenames - registered_filenames
 
+    def _load_state(self) -> list:
+        """Lee el historial de la planta una sola vez por corrida."""
+        if self._registered_files is None:
+            self._registered_files = []
+            if self.state_file.exists():
+                try:
+                    with open(self.state_file, 'r', encoding='utf-8') as f:
+                        self._registered_files = json.load(f)
+                except: pass
+        return self._registered_files
+
     def _save_state(self, newly_processed_files: list):
         """Añade los nuevos archivos exitosos al historial de la planta."""
         if not newly_processed_files:
             return
             
-        registered_files = []
-        if self.state_file.exists():
-            try:
-                with open(self.state_file, 'r', encoding='utf-8') as f:
-                    registered_files = json.load(f)
-            except:
-                pass
-                
         # Merge evitando duplicados
-        updated_files = list(set(registered_files + newly_processed_files))
+        updated_files = sorted(set(self._load_state() + newly_processed_files))
         
+        # Escritura compacta a un temporal y reemplazo atómico (un corte a mitad no deja el historial corrupto)
         self.state_file.parent.mkdir(parents=True, exist_ok=True)
-        with open(self.state_file, 'w', encoding='utf-8') as f:
-            json.dump(updated_files, f, indent=4, ensure_ascii=False)
+        tmp_file = self.state_file.with_suffix('.json.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(updated_files, f, separators=(',', ':'), ensure_ascii=False)
+        os.replace(tmp_file, self.state_file)
+        self._registered_files = updated_files
             
         logging.info(f"Historial actualizado para {self.plant.name}: +{len(newly_processed_files)} archivos.")
 
@@ -75,15 +129,56 @@ class DataExtractor:
 
     def _get_target_columns(self) -> list:
         """Obtiene las columnas reales de la BD, omitiendo las de sistema."""
-        query = """
-            SELECT column_name 
-            FROM information_schema.columns 
-            WHERE lower(table_name) = 'raw_data'
-            ORDER BY ordinal_position;
-        """
-        db_cols = [row[0].lower() for row in self.db.execute_single_query(query, fetchall=True)]
+        db_cols = [c.lower() for c in self.db.get_table_columns('raw_data')]
         return [c for c in db_cols if c not in {'id', 'status', 'created_at', 'processed_at'}]
 
+    def _csv_executor(self, n_archivos: int):
+        """Pool de procesos para la limpieza de CSVs (o un hilo si no aplica)."""
+        workers = min(os.cpu_count() or 1, n_archivos)
+        if workers > 1:
+            return process_pool_executor(workers)
+        return ThreadPoolExecutor(max_workers=1)
+
+    def _load_cleaned_file(self, filename: str, futuro, target_columns: list):
+        """Inserta en la BD un archivo ya limpiado por un worker (una transacción por archivo)."""
+        ts_col = target_columns[0]
+        try:
+            df, error = futuro.result()
+            if error:
+                self._log_error(filename, *error)
+                return
+            cleaned_rows = len(df)
+
+            # 5. Inventario (load_control)
+            if not df.empty:
+                inv_df = df[[ts_col]].copy()
+                inv_df['d'] = inv_df[ts_col].dt.date
+                stats = inv_df.groupby('d')[ts_col].agg(['min', 'max', 'count']).reset_index()
+
+                # Un solo UPSERT por archivo (todas las fechas), dentro de la misma transacción que la carga
+                upsert_sql = """
+                    INSERT INTO load_control (inventory_date, min_time, max_time, row_count, last_updated)
+                    VALUES %s
+                    ON CONFLICT (inventory_date) DO UPDATE SET
+                        min_time = LEAST(load_control.min_time, EXCLUDED.min_time),
+                        max_time = GREATEST(load_control.max_time, EXCLUDED.max_time),
+                        row_count = load_control.row_count + EXCLUDED.row_count,
+                        last_updated = NOW();
+                """
+                inv_records = list(zip(stats['d'], stats['min'].dt.time, stats['max'].dt.time, stats['count'].tolist()))
+                execute_values(self.db.cursor, upsert_sql, inv_records, template="(%s, %s, %s, %s, NOW())")
+
+            # 6. Carga Masiva a raw_data vía COPY FROM STDIN (NaN/NaT -> NULL en la serialización)
+            self.db.copy_records("raw_data", target_columns, df.itertuples(index=False, name=None))
+            self.db.conn.commit()
+            
+            logging.info(f"✓ {cleaned_rows} filas insertadas desde {filename}.")
+            self.archivos_procesados_ok.append(filename)
+
+        except Exception as e:
+            self.db.conn.rollback()
+            self._log_error(filename, "ERROR_CRITICO", f"Error inesperado: {str(e)}")
+
     def run(self):
         """Ejecuta el ciclo de extracción para la planta actual."""
         logging.info(f"--- Iniciando Extracción: {self.plant.name} ---")
@@ -101,92 +196,35 @@ class DataExtractor:
                 self._log_error("SISTEMA", "ERROR_BD", "No se detectaron columnas en 'raw_data'.")
                 return
                 
-            db_num_columns = len(target_columns)
-            ts_col = target_columns[0]
-            
-            for filename in sorted(list(new_files)):
-                file_path = self.input_dir / filename
-                logging.info(f"Procesando: {filename}")
-                
-                try:
-                    # 1. Lectura
-                    try:
-                        df = SmartCsvReader.read_csv_robust(str(file_path), db_num_columns)
-                    except ValueError as e:
-                        self._log_error(filename, "ERROR_LECTURA", str(e))
-                        continue
-
-                    # 2. Validación de columnas
-                    if len(df.columns) != db_num_columns:
-                        self._log_error(filename, "ERROR_COLUMNAS", f"Esperadas {db_num_columns}, encontradas {len(df.columns)}")
-                        continue
-                        
-                    df.columns = target_columns
-
-                    # 3. Limpieza de Fechas
-                    df[ts_col] = df[ts_col].astype(str).str.strip()
-                    total_rows_pre = len(df)
-                    df[ts_col] = pd.to_datetime(df[ts_col], infer_datetime_format=True, errors='coerce')
-                    
-                    if df[ts_col].isna().all() and total_rows_pre > 0:
-                        self._log_error(filename, "ERROR_PARSE_FECHAS", "Fallo total de parseo de fechas. Formato desconocido.")
-                        continue
-
-                    df.dropna(subset=[ts_col], inplace=True)
-
-                    # 4. Limpieza Numérica
-                    numeric_cols = [c for c in target_columns if c != ts_col]
-                    for col in numeric_cols:
-                        if df[col].dtype == 'object':
-                             df[col] = df[col].astype(str).str.replace('.', '.', regex=False).str.replace(',', '.', regex=False)
-                        s_numeric = pd.to_numeric(df[col], errors='coerce')
-                        df[col] = enforce_pg_numeric_constraints(s_numeric)
-
-                    df.dropna(how='all', subset=numeric_cols, inplace=True)
-                    cleaned_rows = len(df)
-
-                    if cleaned_rows < self.min_rows_expected:
-                        self._log_error(filename, "ERROR_FILAS", f"Filas insuficientes: {cleaned_rows} (Pre: {total_rows_pre})")
-                        continue
-
-                    # 5. Inventario (load_control)
-                    if not df.empty:
-                        inv_df = df[[ts_col]].copy()
-                        inv_df['d'] = inv_df[ts_col].dt.date
-                        stats = inv_df.groupby('d')[ts_col].agg(['min', 'max', 'count']).reset_index()
-
-                        for _, row in stats.iterrows():
-                            upsert_sql = """
-                                INSERT INTO load_control (inventory_date, min_time, max_time, row_count, last_updated)
-                                VALUES (%s, %s, %s, %s, NOW())
-                                ON CONFLICT (inventory_date) DO UPDATE SET
-                                    min_time = LEAST(load_control.min_time, EXCLUDED.min_time),
-                                    max_time = GREATEST(load_control.max_time, EXCLUDED.max_time),
-                                    row_count = load_control.row_count + EXCLUDED.row_count,
-                                    last_updated = NOW();
-                            """
-                            self.db.execute_single_query(upsert_sql, (row['d'], row['min'].time(), row['max'].time(), row['count']))
-
-                    # 6. Carga Masiva a raw_data
-                    df_to_load = df.where(pd.notnull(df), None)
-                    cols_str = '", "'.join(target_columns)
-                    query = f'INSERT INTO "raw_data" ("{cols_str}") VALUES %s'
-                    data_tuples = list(df_to_load.itertuples(index=False, name=None))
-                    
-                    # Usamos el cursor expuesto por la conexión de db_manager
-                    execute_values(self.db.cursor, query, data_tuples)
-                    self.db.conn.commit()
-                    
-                    logging.info(f"✓ {cleaned_rows} filas insertadas desde {filename}.")
-                    self.archivos_procesados_ok.append(filename)
-
-                except Exception as e:
-                    self.db.conn.rollback()
-                    self._log_error(filename, "ERROR_CRITICO", f"Error inesperado: {str(e)}")
+            if self.fast_load:
+                # Se confirma aparte: el rollback de un archivo fallido no debe deshacer el SET
+                self.db.cursor.execute("SET synchronous_commit TO OFF;")
+                self.db.conn.commit()
+
+            archivos = sorted(new_files)
+            # Lectura y limpieza en paralelo (CPU); la escritura en BD queda en este proceso, en orden
+            # Ventana acotada de archivos en vuelo: los DataFrames limpios no se acumulan en memoria si la carga va más lenta
+            ventana = 2 * min(os.cpu_count() or 1, len(archivos))
+            with self._csv_executor(len(archivos)) as pool:
+                def enviar(f):
+                    return f, pool.submit(_read_and_clean_csv, str(self.input_dir / f), target_columns, self.min_rows_expected)
+                pendientes = iter(archivos)
+                en_vuelo = deque(enviar(f) for f in islice(pendientes, ventana))
+                while en_vuelo:
+                    filename, futuro = en_vuelo.popleft()
+                    logging.info(f"Procesando: {filename}")
+                    self._load_cleaned_file(filename, futuro, target_columns)
+                    en_vuelo.extend(enviar(f) for f in islice(pendientes, 1))
 
         except Exception as e:
             self._log_error("SISTEMA", "ERROR_GLOBAL", f"Fallo al procesar la planta: {str(e)}")
             
         finally:
+            if self.fast_load:
+                try:
+                    self.db.cursor.execute("RESET synchronous_commit;")
+                    self.db.conn.commit()
+                except Exception:
+                    self.db.conn.rollback()
             # Guardamos en el historial local SOLO los que fueron exitosos
             self._save_state(self.archivos_procesados_ok)
\ No newline at end of file
@@ -25,7 +25,7 @@ class GraphicsGenerator:
             SELECT ve.offending_column AS nombre_columna, COUNT(*) AS cantidad
             FROM validation_error_by_rules ve
             JOIN raw_data rd ON ve.raw_data_id = rd.id
-            WHERE ve.error_type = %s AND rd.timestamp::time BETWEEN %s AND %s AND DATE(ve.created_at) = CURRENT_DATE
+            WHERE ve.error_type = %s AND rd.timestamp::time BETWEEN %s AND %s AND ve.created_at >= CURRENT_DATE AND ve.created_at < CURRENT_DATE + 1
             GROUP BY ve.offending_column
         """
         rows = self.db.execute_single_query(query, (error_type, self.START_TIME, self.END_TIME), fetchall=True)
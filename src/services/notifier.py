@@ -1,11 +1,11 @@
 import logging
-import smtplib
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
 from src.models.plant import Plant
 from src.core.database import DatabaseManager
+from src.utils.helpers import open_smtp
 
 class Notifier:
     def __init__(self, db_manager: DatabaseManager, plant: Plant, smtp_config: dict, extraction_errors: list):
@@ -23,10 +23,16 @@ class Notifier:
         """Consulta a la base de datos para obtener los KPIs del día."""
         today = date.today()
         try:
-            self.metrics['errores'] = self.db.execute_single_query("SELECT COUNT(*) FROM validation_error_by_rules WHERE DATE(created_at) = %s AND error_type = 'error'", (today,), fetchone=True)[0]
-            self.metrics['alarmas'] = self.db.execute_single_query("SELECT COUNT(*) FROM validation_error_by_rules WHERE DATE(created_at) = %s AND error_type = 'alarm'", (today,), fetchone=True)[0]
-            self.metrics['validados'] = self.db.execute_single_query("SELECT COUNT(*) FROM validated_data WHERE DATE(created_at) = %s", (today,), fetchone=True)[0]
-            self.metrics['dias_cargados'] = self.db.execute_single_query("SELECT COUNT(*) FROM load_control WHERE DATE(last_updated) = %s", (today,), fetchone=True)[0]
+            # KPIs del día en una sola consulta (un round-trip en lugar de cuatro); rangos sobre created_at para usar índices
+            kpi_query = """
+                SELECT
+                    (SELECT COUNT(*) FROM validation_error_by_rules WHERE created_at >= %s AND created_at < %s AND error_type = 'error'),
+                    (SELECT COUNT(*) FROM validation_error_by_rules WHERE created_at >= %s AND created_at < %s AND error_type = 'alarm'),
+                    (SELECT COUNT(*) FROM validated_data WHERE created_at >= %s AND created_at < %s),
+                    (SELECT COUNT(*) FROM load_control WHERE last_updated >= %s AND last_updated < %s)
+            """
+            kpis = self.db.execute_single_query(kpi_query, (today, today + timedelta(days=1)) * 4, fetchone=True)
+            self.metrics['errores'], self.metrics['alarmas'], self.metrics['validados'], self.metrics['dias_cargados'] = kpis
             
             # Cobertura Anual
             cov_query = """
@@ -66,9 +72,7 @@ class Notifier:
             ext_err_html = f"<div style='background:#FEF2F2; padding:15px; border-left:4px solid #EF4444; margin-bottom:20px;'><h4 style='color:#991B1B; margin-top:0;'>⚠️ Errores de Lectura CSV</h4><ul>{lis}</ul></div>"
 
         # Previews
-        preview_rows = ""
-        for row in self.previews:
-            preview_rows += f"<tr><td style='padding:8px; border-bottom:1px solid #ddd;'>{row[0]}</td><td style='padding:8px; border-bottom:1px solid #ddd;'>{row[2]}</td><td style='padding:8px; border-bottom:1px solid #ddd; color:#d32f2f;'>{str(row[3])[:30]}</td></tr>"
+        preview_rows = "".join([f"<tr><td style='padding:8px; border-bottom:1px solid #ddd;'>{row[0]}</td><td style='padding:8px; border-bottom:1px solid #ddd;'>{row[2]}</td><td style='padding:8px; border-bottom:1px solid #ddd; color:#d32f2f;'>{str(row[3])[:30]}</td></tr>" for row in self.previews])
         
         preview_table = f"<table style='width:100%; text-align:left; border-collapse:collapse; font-size:13px;'><tr style='background:#f9f9f9;'><th>Timestamp</th><th>Columna</th><th>Valor</th></tr>{preview_rows}</table>" if self.previews else "<p>No hay errores detectados.</p>"
 
@@ -148,9 +152,7 @@ class Notifier:
             msg['Subject'] = asunto
             msg.attach(MIMEText(html_body, 'html', 'utf-8'))
             
-            with smtplib.SMTP(self.smtp_config['server'], self.smtp_config['port']) as server:
-                server.starttls()
-                server.login(self.smtp_config['user'], self.smtp_config['password'])
+            with open_smtp(self.smtp_config) as server:
                 server.send_message(msg)
                 
             logging.info(f"Correo enviado a: {msg['To']}")
@@ -59,18 +59,29 @@ class ColumnNameProcessor:
 
 
 class SchemaBuilder:
+    NUMERIC_TYPE = "NUMERIC(26, 13)"
+    # DDL idempotente para BDs ya desplegadas: CREATE TABLE IF NOT EXISTS no modifica tablas existentes
+    UPGRADE_QUERIES = [
+        """DO $$BEGIN IF EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'fk_duplicate_raw' AND conrelid = 'duplicated_data'::regclass AND NOT condeferrable) THEN ALTER TABLE duplicated_data ALTER CONSTRAINT fk_duplicate_raw DEFERRABLE INITIALLY DEFERRED; END IF; END$$;""",
+        """CREATE INDEX IF NOT EXISTS idx_raw_data_timestamp_id ON raw_data (timestamp, id);""",
+        """CREATE INDEX IF NOT EXISTS idx_validated_data_created_at ON validated_data (created_at);""",
+        """CREATE INDEX IF NOT EXISTS idx_validation_errors_created_at ON validation_error_by_rules (created_at);""",
+        """CREATE INDEX IF NOT EXISTS idx_excluded_data_active_range ON excluded_data (exclusion_start, exclusion_end) WHERE exclusion = 0;"""
+    ]
+
     def __init__(self, db_manager: DatabaseManager, column_names: List[str]):
         self.db = db_manager
         self.column_names = column_names
+        # Las definiciones de columnas de datos se arman una sola vez; solo cambia la de timestamp
+        self._data_columns_sql = ",\n    ".join(f'"{col_name}" {self.NUMERIC_TYPE}' for col_name in column_names)
 
     def generate_columns_sql(self, use_timestamp_col: bool = False) -> str:
-        numeric_type = "NUMERIC(26, 13)"
         timestamp_column_name = "timestamp_col" if use_timestamp_col else "timestamp"
         not_null = " NOT NULL" if not use_timestamp_col else ""
-        columns_sql = [f"{timestamp_column_name} TIMESTAMPTZ{not_null}"]
-        for col_name in self.column_names:
-            columns_sql.append(f'"{col_name}" {numeric_type}')
-        return ",\n    ".join(columns_sql)
+        timestamp_sql = f"{timestamp_column_name} TIMESTAMPTZ{not_null}"
+        if not self._data_columns_sql:
+            return timestamp_sql
+        return f"{timestamp_sql},\n    {self._data_columns_sql}"
 
     def build(self):
         """Ejecuta todos los queries de creación de tablas"""
@@ -89,7 +100,7 @@ class SchemaBuilder:
             f"""CREATE TABLE IF NOT EXISTS validated_data (id BIGSERIAL PRIMARY KEY, raw_data_id BIGINT UNIQUE NOT NULL, {base_columns}, status data_status NOT NULL DEFAULT 'pending', created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP, processed_at TIMESTAMPTZ, CONSTRAINT fk_validated_raw FOREIGN KEY (raw_data_id) REFERENCES raw_data(id) ON DELETE CASCADE);""",
             """CREATE TABLE IF NOT EXISTS validated_data_by_rules (id BIGSERIAL PRIMARY KEY, validated_data_id BIGINT NOT NULL, rule_id INT NOT NULL, created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP, CONSTRAINT fk_vdr_validated FOREIGN KEY (validated_data_id) REFERENCES validated_data(id) ON DELETE CASCADE, CONSTRAINT fk_vdr_rules FOREIGN KEY (rule_id) REFERENCES validation_rules(id) ON DELETE CASCADE, UNIQUE (validated_data_id, rule_id));""",
             """CREATE TABLE IF NOT EXISTS validation_error_by_rules (id BIGSERIAL PRIMARY KEY, raw_data_id BIGINT NOT NULL, validation_rule_id INT, offending_column VARCHAR(255), offending_value TEXT, error_type VARCHAR(20) DEFAULT 'error' CHECK (error_type IN ('error', 'alarm')), created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP, CONSTRAINT fk_error_raw FOREIGN KEY (raw_data_id) REFERENCES raw_data(id) ON DELETE CASCADE, CONSTRAINT fk_error_rule FOREIGN KEY (validation_rule_id) REFERENCES validation_rules(id) ON DELETE SET NULL);""",
-            f"""CREATE TABLE IF NOT EXISTS duplicated_data (id BIGSERIAL PRIMARY KEY, raw_data_id BIGINT, {duplicated_columns}, detected_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP, CONSTRAINT fk_duplicate_raw FOREIGN KEY (raw_data_id) REFERENCES raw_data(id) ON DELETE SET NULL);""",
+            f"""CREATE TABLE IF NOT EXISTS duplicated_data (id BIGSERIAL PRIMARY KEY, raw_data_id BIGINT, {duplicated_columns}, detected_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP, CONSTRAINT fk_duplicate_raw FOREIGN KEY (raw_data_id) REFERENCES raw_data(id) ON DELETE SET NULL DEFERRABLE INITIALLY DEFERRED);""",
             """CREATE TABLE IF NOT EXISTS excluded_data (id BIGSERIAL PRIMARY KEY, form_timestamp TIMESTAMPTZ NOT NULL UNIQUE, exclusion_start TIMESTAMPTZ NOT NULL, exclusion_end TIMESTAMPTZ NOT NULL, exclusion_type VARCHAR(100), exclusion INTEGER NOT NULL, motivo TEXT, observacion TEXT, potencia_pico_kw NUMERIC(10, 2), excluded_variables TEXT, created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP);""",
             """CREATE TABLE IF NOT EXISTS excluded_data_logs (log_id BIGSERIAL PRIMARY KEY, excluded_data_id BIGINT, deleted_id BIGINT, operation_type VARCHAR(50), changed_by VARCHAR(100), created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP, CONSTRAINT fk_log_excluded_data FOREIGN KEY (excluded_data_id) REFERENCES excluded_data(id) ON DELETE SET NULL);""",
             """CREATE OR REPLACE VIEW public.view_potencia_pico_kw_ultimo_registro AS SELECT CURRENT_TIMESTAMP AS fecha_consulta, COALESCE(override_data.potencia_pico_kw, planta.potencia_pico_kw) AS potencia_activa_kw, COALESCE(override_data.form_timestamp, planta.created_at)::timestamp WITHOUT TIME ZONE AS modified_at, CASE WHEN override_data.id IS NOT NULL THEN 'EXCLUSION/MODIFICACION (' || override_data.exclusion_type || ')' ELSE 'PARAMETRO_BASE' END AS origen_dato, override_data.id as id_registro_tomado FROM (SELECT potencia_pico_kw, created_at FROM public.parametros_planta ORDER BY id DESC LIMIT 1) planta LEFT JOIN LATERAL (SELECT potencia_pico_kw, id, exclusion_type, form_timestamp FROM public.excluded_data WHERE exclusion_start <= CURRENT_TIMESTAMP AND (exclusion_end > CURRENT_TIMESTAMP OR exclusion_type LIKE 'Modificación%' OR exclusion_start = exclusion_end) ORDER BY form_timestamp DESC LIMIT 1) override_data ON TRUE;""",
@@ -100,24 +111,41 @@ class SchemaBuilder:
         
         logging.info(f">>> Creando esquema para {self.db.plant.name}...")
         self.db.execute_queries(queries)
+        self.upgrade(self.db)
         logging.info(f"Esquema completado para {self.db.plant.name}.")
 
+    @classmethod
+    def upgrade(cls, db_manager: DatabaseManager):
+        """Aplica los cambios de esquema posteriores a la creación (se ejecuta en cada arranque del pipeline)."""
+        db_manager.execute_queries(cls.UPGRADE_QUERIES)
+
 # -------------------------------------------------------------------
 # BLOQUE DE EJECUCIÓN INDEPENDIENTE (Para correrlo cuando tú quieras)
 # -------------------------------------------------------------------
 if __name__ == "__main__":
+    import argparse
     from src.core.config_loader import ConfigLoader
     
+    parser = argparse.ArgumentParser(description="Inicializa la base de datos de una planta.")
+    parser.add_argument("--config", default="config.json", help="Ruta al config.json de plantas.")
+    parser.add_argument("--plant", help="ID de la planta (ej. planta1). Si se omite, se pregunta por consola.")
+    args = parser.parse_args()
+    
     # 1. Cargar configuraciones
-    loader = ConfigLoader()
+    loader = ConfigLoader(args.config)
     
-    # 2. Preguntar a qué planta se le aplicará (útil para uso manual)
-    print("Plantas disponibles:")
-    for i, p in enumerate(loader.plants):
-        print(f"[{i}] {p.name}")
-        
-    seleccion = int(input("\nIngresa el número de la planta para inicializar su BD: "))
-    planta_elegida = loader.plants[seleccion]
+    # 2. Resolver la planta: por argumento (modo batch) o interactivo como respaldo
+    if args.plant:
+        planta_elegida = next((p for p in loader.plants if p.id == args.plant), None)
+        if planta_elegida is None:
+            parser.error(f"Planta '{args.plant}' no encontrada. Disponibles: {', '.join(p.id for p in loader.plants)}")
+    else:
+        print("Plantas disponibles:")
+        for i, p in enumerate(loader.plants):
+            print(f"[{i}] {p.name}")
+            
+        seleccion = int(input("\nIngresa el número de la planta para inicializar su BD: "))
+        planta_elegida = loader.plants[seleccion]
     
     # 3. Flujo de creación
     try:
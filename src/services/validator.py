@@ -1,15 +1,22 @@
 import json
 import logging
 import re
+import numpy as np
 import pandas as pd
+from functools import lru_cache
 from pathlib import Path
-from psycopg2.extras import execute_values
+from psycopg2.extras import execute_values, Json
+from psycopg2.extensions import register_type
 
 from src.models.plant import Plant
-from src.core.database import DatabaseManager
+from src.core.database import DatabaseManager, NUMERIC_A_FLOAT
 from src.utils.validation_tools import SolarConditionClassifier, ValidationBypassHandler
 
 class DataValidator:
+    # Filas de raw_data por lote leído del cursor de servidor
+    BATCH_SIZE = 5000
+    ERROR_COLUMNS = ['raw_data_id', 'validation_rule_id', 'offending_column', 'offending_value', 'error_type']
+
     def __init__(self, db_manager: DatabaseManager, plant: Plant):
         self.db = db_manager
         self.plant = plant
@@ -34,7 +41,7 @@ class DataValidator:
         
         records = []
         for rule in rules:
-            cfg = json.dumps(rule.get("rule_config")) if rule.get("rule_config") else None
+            cfg = Json(rule["rule_config"]) if rule.get("rule_config") else None
             records.append((rule["column_pattern"], rule["rule_type"], cfg, rule["error_message"], rule.get("is_active", True)))
         
         if records:
@@ -42,6 +49,105 @@ class DataValidator:
             execute_values(self.db.cursor, query, records)
             self.db.conn.commit()
 
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def _compile_rule(rule_type: str, cfg_json: str):
+        """Traduce una regla a una función vectorizada Series -> máscara de fallos (memoizada por tipo + config)."""
+        cfg = json.loads(cfg_json)
+        if rule_type == 'not_null':
+            return lambda serie: serie.isna().to_numpy()
+
+        if rule_type == 'range':
+            lo = float(cfg['min']) if 'min' in cfg else None
+            hi = float(cfg['max']) if 'max' in cfg else None
+
+            def check_range(serie, lo=lo, hi=hi):
+                nulos = serie.isna().to_numpy()
+                try:
+                    # Camino rápido: conversión directa en C (Decimal/None -> float64/NaN)
+                    valores = serie.astype(float).to_numpy()
+                except (TypeError, ValueError):
+                    valores = pd.to_numeric(serie, errors='coerce').to_numpy(dtype=float)
+                fallos = np.isnan(valores)  # No convertibles a número
+                if lo is not None: fallos |= valores < lo
+                if hi is not None: fallos |= valores > hi
+                return fallos & ~nulos
+            return check_range
+
+        if rule_type == 'enum':
+            allowed = cfg.get('allowed_values', [])
+            return lambda serie, allowed=allowed: ~serie.isin(allowed).to_numpy() & ~serie.isna().to_numpy()
+
+        return lambda serie: np.zeros(len(serie), dtype=bool)
+
+    def _validate_batch(self, df: pd.DataFrame, chequeos: list, columnas_db: list, solar_classifier: SolarConditionClassifier, bypass_handler: ValidationBypassHandler, stats: dict):
+        """Valida un lote de raw_data y deja sus resultados en la transacción abierta. Retorna (ok, errores)."""
+        df['solar_classification'] = solar_classifier.classify_dataframe(df)
+        ts_col = columnas_db[0]
+        
+        # Vistas por posición para el manejo de filas fallidas
+        ids_arr = df['id'].to_numpy()
+        clasif_arr = df['solar_classification'].to_numpy()
+        ids = ids_arr.tolist()
+        timestamps = df[ts_col].tolist()
+        clasificaciones = clasif_arr.tolist()
+        estado_final = np.full(len(df), 'success', dtype=object)
+        
+        errores_db = []
+
+        # 1. Chequeos sin excepciones activas posibles: matriz de fallos (chequeos x filas) y un solo np.nonzero
+        directos = [c for c in chequeos if not c[3]]
+        if directos:
+            fallos = np.vstack([check(df[col]) for col, _, check, _ in directos])
+            chk_idx, fila_idx = np.nonzero(fallos)
+            if len(fila_idx):
+                estado_final[fila_idx] = 'error'
+                stats['checked'] += len(fila_idx)
+                stats['errors'] += len(fila_idx)
+                # Payload de errores armado por fancy indexing, en el mismo orden (chequeo, fila)
+                valores = df[[c[0] for c in directos]].to_numpy()[fila_idx, chk_idx]
+                textos = [str(v) if v == v and v is not None else 'None' for v in valores]
+                reglas_arr = np.array([c[1] for c in directos])
+                cols_arr = np.array([c[0] for c in directos], dtype=object)
+                errores_db.extend(zip(ids_arr[fila_idx].tolist(), reglas_arr[chk_idx].tolist(), cols_arr[chk_idx].tolist(), textos, clasif_arr[fila_idx].tolist()))
+
+        # 2. Chequeos con excepciones posibles: solo las celdas fallidas se recorren en Python
+        for col, regla_id, check, puede_bypass in chequeos:
+            if not puede_bypass: continue
+            serie = df[col]
+            fallidos = np.flatnonzero(check(serie))
+            if not len(fallidos): continue
+            valores = serie.to_numpy()
+            stats['checked'] += len(fallidos)
+
+            for i in fallidos:
+                if bypass_handler.should_bypass(timestamps[i], col):
+                    if estado_final[i] != 'error': estado_final[i] = 'waived'
+                    stats['bypassed'] += 1
+                else:
+                    estado_final[i] = 'error'
+                    stats['errors'] += 1
+                    errores_db.append((ids[i], regla_id, col, str(valores[i]) if pd.notna(valores[i]) else 'None', clasificaciones[i]))
+
+        df['status'] = estado_final
+        success_df = df[df['status'].isin(['success', 'waived'])]
+        error_df = df[df['status'] == 'error']
+
+        if errores_db:
+            self.db.copy_records("validation_error_by_rules", self.ERROR_COLUMNS, errores_db)
+
+        # Copia de válidas (dentro del servidor, NUMERIC exacto) + un solo UPDATE de estados, en un mismo envío
+        # ('waived' en raw_data queda como 'success')
+        estados_raw = np.where(estado_final == 'error', 'error', 'success').tolist()
+        sentencias = ["EXECUTE actualizar_estado_raw(%s::bigint[], %s::data_status[])"]
+        params = [ids, estados_raw]
+        if not success_df.empty:
+            sentencias.insert(0, "EXECUTE copiar_validados(%s::bigint[], %s::data_status[])")
+            params[:0] = [success_df['id'].tolist(), success_df['status'].tolist()]
+        self.db.cursor.execute(";\n".join(sentencias), params)
+
+        return len(success_df), len(error_df)
+
     def process(self):
         """Motor principal de validación."""
         try:
@@ -50,90 +156,69 @@ class DataValidator:
             
             # Cargar Metadatos
             reglas_raw = self.db.execute_single_query("SELECT id, column_pattern, rule_type, rule_config, error_message FROM validation_rules WHERE is_active = TRUE", fetchall=True)
-            reglas = [{'id': r[0], 'column_pattern': r[1], 'rule_type': r[2], 'rule_config': r[3], 'error_message': r[4]} for r in reglas_raw]
+            columnas_db = [c for c in self.db.get_table_columns('raw_data') if c not in ('id', 'status', 'created_at', 'processed_at')]
             
-            columnas_db = [c[0] for c in self.db.execute_single_query("SELECT column_name FROM information_schema.columns WHERE lower(table_name) = 'raw_data' AND column_name NOT IN ('id', 'status', 'created_at', 'processed_at') ORDER BY ordinal_position;", fetchall=True)]
+            reglas = []
+            for r in reglas_raw:
+                try:
+                    check = self._compile_rule(r[2], json.dumps(r[3] or {}, sort_keys=True))
+                except (TypeError, ValueError) as e:
+                    logging.error(f"[{self.plant.name}] Regla {r[0]} ({r[1]}) mal configurada, se omite: {e}")
+                    continue
+                pat = r[1].lower()
+                target_cols = [c for c in columnas_db if pat in c.lower() or (re.search(pat, c, re.IGNORECASE) if '*' in pat or '^' in pat else False)]
+                reglas.append({'id': r[0], 'column_pattern': r[1], 'rule_type': r[2], 'check': check, 'target_cols': target_cols, 'error_message': r[4]})
             
             if not reglas or not columnas_db: return
 
-            # Leer Pending
-            self.db.cursor.execute("SELECT * FROM raw_data WHERE status = 'pending' ORDER BY id")
-            pending_data = self.db.cursor.fetchall()
-            if not pending_data:
-                logging.info(f"[{self.plant.name}] ✓ No hay datos pendientes de validación.")
-                return
-                
-            df = pd.DataFrame(pending_data, columns=[d[0] for d in self.db.cursor.description])
-            
+            # Columnas de lectura y de copia: constantes durante toda la corrida
+            cols_datos_str = ", ".join(f'r."{c}"' for c in columnas_db)
+            cols_validados_str = ", ".join(f'"{c}"' for c in ['raw_data_id', 'status'] + columnas_db)
+            # Lectura con lista explícita: no viajan status/created_at/processed_at y no se depende de cursor.description
+            cols_stream = ['id'] + columnas_db
+            cols_lectura_str = ", ".join(f'"{c}"' for c in cols_stream)
+
             # Le pasamos el plant_name para que el Regex funcione dinámicamente
             solar_classifier = SolarConditionClassifier(
                 available_columns=columnas_db, 
                 plant_name=self.plant.name
             )
             bypass_handler = ValidationBypassHandler(self.db)
-            
-            df['solar_classification'] = solar_classifier.classify_dataframe(df)
-            df['final_status'] = 'success'
-            ts_col = columnas_db[0]
-            
-            errores_db = []
+            chequeos = [(col, regla['id'], regla['check'], bypass_handler.applies_to(col)) for regla in reglas for col in regla['target_cols']]
+            self.db.prepare("actualizar_estado_raw", """
+                UPDATE raw_data r SET status = t.status, processed_at = NOW()
+                FROM unnest($1, $2) AS t(id, status)
+                WHERE r.id = t.id
+            """, ('bigint[]', 'data_status[]'))
+            self.db.prepare("copiar_validados", f"""
+                INSERT INTO validated_data ({cols_validados_str})
+                SELECT r.id, t.status, {cols_datos_str}
+                FROM raw_data r JOIN unnest($1, $2) AS t(id, status) ON r.id = t.id
+                ORDER BY r.id
+            """, ('bigint[]', 'data_status[]'))
             stats = {'checked': 0, 'bypassed': 0, 'errors': 0}
+            total_ok, total_err = 0, 0
 
-            # Motor de Reglas
-            for regla in reglas:
-                pat = regla['column_pattern'].lower()
-                target_cols = [c for c in columnas_db if pat in c.lower() or (re.search(pat, c, re.IGNORECASE) if '*' in pat or '^' in pat else False)]
-                cfg = regla['rule_config'] or {}
+            # Leer Pending por lotes con un cursor del lado del servidor (memoria acotada, un solo plan)
+            with self.db.conn.cursor(name='raw_pending_stream') as stream:
+                stream.itersize = self.BATCH_SIZE
+                register_type(NUMERIC_A_FLOAT, stream)
+                stream.execute(f"SELECT {cols_lectura_str} FROM raw_data WHERE status = 'pending' ORDER BY id")
                 
-                for col in target_cols:
-                    for idx, row in df.iterrows():
-                        val = row[col]
-                        ok = True
-                        if pd.isna(val): ok = (regla['rule_type'] != 'not_null')
-                        elif regla['rule_type'] == 'range':
-                            try:
-                                v = float(val)
-                                if 'min' in cfg and v < cfg['min']: ok = False
-                                if 'max' in cfg and v > cfg['max']: ok = False
-                            except: ok = False
-                        elif regla['rule_type'] == 'enum':
-                            if val not in cfg.get('allowed_values', []): ok = False
-                            
-                        if not ok:
-                            stats['checked'] += 1
-                            if bypass_handler.should_bypass(row[ts_col], col):
-                                if df.at[idx, 'final_status'] != 'error': df.at[idx, 'final_status'] = 'waived'
-                                stats['bypassed'] += 1
-                            else:
-                                df.at[idx, 'final_status'] = 'error'
-                                stats['errors'] += 1
-                                errores_db.append((row['id'], regla['id'], col, str(val), row['solar_classification']))
-
-            df['status'] = df['final_status']
-            success_df = df[df['status'].isin(['success', 'waived'])]
-            error_df = df[df['status'] == 'error']
-
-            # Guardar en DB
-            if not success_df.empty:
-                cols_ins = ['raw_data_id', 'status'] + [c for c in success_df.columns if c in columnas_db]
-                cols_formatted = ','.join([f'"{c}"' for c in cols_ins])
-                query = f"INSERT INTO validated_data ({cols_formatted}) VALUES %s"
-                records = [tuple([row['id'], row['status']] + [row[c] for c in cols_ins[2:]]) for _, row in success_df.iterrows()]
-                execute_values(self.db.cursor, query, records)
-
-            if errores_db:
-                execute_values(self.db.cursor, "INSERT INTO validation_error_by_rules (raw_data_id, validation_rule_id, offending_column, offending_value, error_type) VALUES %s", errores_db)
-            
-            if not success_df.empty:
-                ok_ids = success_df['id'].tolist()
-                self.db.cursor.execute("UPDATE raw_data SET status='success', processed_at=NOW() WHERE id = ANY(%s)", (ok_ids,))
-            
-            if not error_df.empty:
-                err_ids = error_df['id'].tolist()
-                self.db.cursor.execute("UPDATE raw_data SET status='error', processed_at=NOW() WHERE id = ANY(%s)", (err_ids,))
+                while True:
+                    lote = stream.fetchmany(self.BATCH_SIZE)
+                    if not lote: break
+                    df = pd.DataFrame(lote, columns=cols_stream)
+                    n_ok, n_err = self._validate_batch(df, chequeos, columnas_db, solar_classifier, bypass_handler, stats)
+                    total_ok += n_ok
+                    total_err += n_err
+
+            if total_ok + total_err == 0:
+                logging.info(f"[{self.plant.name}] ✓ No hay datos pendientes de validación.")
+                return
 
             self.db.conn.commit()
-            logging.info(f"[{self.plant.name}] ✓ Validación: {len(success_df)} OK/Waived | {len(error_df)} Errores (Bypassed: {stats['bypassed']})")
+            logging.info(f"[{self.plant.name}] ✓ Validación: {total_ok} OK/Waived | {total_err} Errores (Bypassed: {stats['bypassed']})")
 
         except Exception as e:
             self.db.conn.rollback()
@@ -1,14 +1,21 @@
 import os
 import re
+import smtplib
 import unicodedata
 import logging
+import multiprocessing as mp
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import List
+from typing import List, Union
 import pandas as pd
 
 class ColumnNameProcessor:
     """Procesa y sanitiza nombres de columnas."""
     MAX_COLUMN_NAME_LENGTH = 63
+    # Patrones compilados una sola vez (se usan por cada nombre de columna/variable)
+    BRACKETS_PATTERN = re.compile(r'\[.*?\]')
+    INVALID_CHARS_PATTERN = re.compile(r'[^a-z0-9_]+')
+    UNDERSCORES_PATTERN = re.compile(r'_+')
     
     @staticmethod
     def sanitize_column_name(raw_name: str) -> str:
@@ -16,7 +23,7 @@ class ColumnNameProcessor:
             return ""
             
         name = raw_name.lower()
-        name = re.sub(r'\[.*?\]', '', name)
+        name = ColumnNameProcessor.BRACKETS_PATTERN.sub('', name)
         name = unicodedata.normalize('NFD', name)
         name = ''.join(char for char in name if unicodedata.category(char) != 'Mn')
         
@@ -24,8 +31,8 @@ class ColumnNameProcessor:
         for old_char, new_char in replacements.items():
             name = name.replace(old_char, new_char)
         
-        name = re.sub(r'[^a-z0-9_]+', '_', name)
-        name = re.sub(r'_+', '_', name)
+        name = ColumnNameProcessor.INVALID_CHARS_PATTERN.sub('_', name)
+        name = ColumnNameProcessor.UNDERSCORES_PATTERN.sub('_', name)
         name = name.strip('_')
         
         if not name:
@@ -39,9 +46,9 @@ class ColumnNameProcessor:
         
         return name
 
-def enforce_pg_numeric_constraints(series: pd.Series, precision: int = 26, scale: int = 13) -> pd.Series:
+def enforce_pg_numeric_constraints(series: Union[pd.Series, pd.DataFrame], precision: int = 26, scale: int = 13) -> Union[pd.Series, pd.DataFrame]:
     """
-    Ajusta una serie numérica para cumplir con PostgreSQL NUMERIC(p, s).
+    Ajusta una serie (o un bloque de columnas) numérica para cumplir con PostgreSQL NUMERIC(p, s).
     Estrategia: Round & Clip (Evita overflow cortando al máximo permitido).
     """
     limit = (10 ** (precision - scale)) - 1.0
@@ -91,4 +98,26 @@ class SmartCsvReader:
         if len(df.columns) > db_num_columns:
             df = df.iloc[:, :db_num_columns]
             
-        return df
\ No newline at end of file
+        return df
+
+def open_smtp(smtp_config: dict) -> smtplib.SMTP:
+    """Abre una sesión SMTP autenticada: TLS directo en el puerto 465 (sin el round-trip de STARTTLS) o STARTTLS en el resto."""
+    tls_directo = int(smtp_config['port']) == 465
+    smtp_cls = smtplib.SMTP_SSL if tls_directo else smtplib.SMTP
+    server = smtp_cls(smtp_config['server'], smtp_config['port'])
+    try:
+        if not tls_directo:
+            server.starttls()
+        server.login(smtp_config['user'], smtp_config['password'])
+    except Exception:
+        # El llamador solo cierra la sesión si la recibe: un fallo en el handshake la cierra aquí
+        server.close()
+        raise
+    return server
+
+def process_pool_executor(max_workers: int) -> Executor:
+    """Pool de procesos con max_workers, o un solo hilo si el proceso actual no puede crear hijos."""
+    # Los workers de multiprocessing.Pool (PIPELINE_WORKERS > 1) son daemon y no pueden crear procesos hijos
+    if not mp.current_process().daemon:
+        return ProcessPoolExecutor(max_workers=max_workers)
+    return ThreadPoolExecutor(max_workers=1)
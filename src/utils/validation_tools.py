@@ -97,6 +97,9 @@ class SolarConditionClassifier:
 
 class ValidationBypassHandler:
     """Gestiona las excepciones (waivers) activas en la BD."""
+    # Compilado una vez: se evalúa por cada celda fallida que puede tener excepción
+    COL_KEY_PATTERN = re.compile(r'^(col_\d+)', re.IGNORECASE)
+
     def __init__(self, db: DatabaseManager):
         self.db = db
         self._active_bypasses = {} 
@@ -118,14 +121,20 @@ class ValidationBypassHandler:
             target_vars = ['ALL'] if not raw_vars else [v.strip() for v in str(raw_vars).split(',') if v.strip()]
             
             for var in target_vars:
-                col_key = re.match(r'^(col_\d+)', var, re.IGNORECASE)
-                col_key = col_key.group(1).lower() if col_key else var.lower().strip()
+                col_key = self._column_key(var)
                 if col_key not in self._active_bypasses: self._active_bypasses[col_key] = []
                 self._active_bypasses[col_key].append({'start': start_dt, 'end': end_dt})
 
+    def _column_key(self, column_name: str) -> str:
+        col_key = self.COL_KEY_PATTERN.match(column_name)
+        return col_key.group(1).lower() if col_key else column_name.lower().strip()
+
+    def applies_to(self, column_name: str) -> bool:
+        """Indica si alguna excepción activa puede afectar a la columna (permite saltar should_bypass)."""
+        return self._column_key(column_name) in self._active_bypasses or 'ALL' in self._active_bypasses
+
     def should_bypass(self, timestamp, column_name: str) -> bool:
-        col_key = re.match(r'^(col_\d+)', column_name, re.IGNORECASE)
-        target_key = col_key.group(1).lower() if col_key else column_name.lower().strip()
+        target_key = self._column_key(column_name)
         
         if target_key not in self._active_bypasses and 'ALL' not in self._active_bypasses: return False
         